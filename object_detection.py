@@ -1,33 +1,98 @@
 import os
+import threading
 import cv2
 import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from ultralytics import YOLO
 
+# libjpeg-turbo's SIMD encoder for saved frames; falls back to cv2.imwrite when
+# PyTurboJPEG or the native libturbojpeg library is not installed
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _turbojpeg = TurboJPEG()
+except Exception:
+    _turbojpeg = None
+
+# Pre-trained YOLOv8 medium pose weights
+MODEL_WEIGHTS = "yolov8m-pose.pt"
+
+# Inference size and the frame shape used to warm the model up before streaming
+INFERENCE_SIZE = 640
+WARMUP_SHAPE = (480, 640, 3)
+
+# Downscaled grayscale size used to detect whether anything moved between frames
+MOTION_SIZE = (80, 60)
+
+# Max annotated frames waiting to be written before new ones are dropped
+MAX_PENDING_SAVES = 16
+
+# On-frame label, drawn with constant font settings
+POSE_LABEL = "POSE DETECTED!"
+POSE_LABEL_ORG = (50, 100)
+POSE_LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# Frames have a fixed size per camera, so let cuDNN pick the fastest conv algorithms once
+torch.backends.cudnn.benchmark = True
+
+
+def resolve_device(device: str) -> str:
+    """Map "auto" to the best available accelerator: CUDA, then Apple MPS, then CPU."""
+    if device != "auto":
+        return device
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
 
 class YOLOv8PoseDetector:
     """
     Detects human poses in video frames using YOLOv8 pose model.
     Draws skeleton keypoints and saves frames when poses are detected.
     """
-    def __init__(self, conf: float = 0.5, device: str = "cpu"):
-        self.device = device
+    def __init__(self, conf: float = 0.5, device: str = "cpu", engine: str = None, export_engine: bool = False,
+                 batch: int = 1, motion_threshold: float = 2.0, save_frames: bool = True, openvino: bool = False,
+                 int8: bool = False, int8_data: str = None):
+        self.device = resolve_device(device)
+        self.batch = max(1, int(batch))  # Max frames per forward pass
+        self.motion_threshold = motion_threshold  # Mean abs pixel diff below which a frame is "unchanged" (0 = off)
         print(f"[detector] Loading YOLOv8 Pose Detection model...")
         
-        # Load the pre-trained YOLOv8 medium pose model
-        self.model = YOLO("yolov8m-pose.pt")
-        self.model.to(self.device)
+        # Load the pose model (TensorRT FP16 engine on CUDA, OpenVINO on CPU when enabled)
+        self.model = self._load_model(engine, export_engine, openvino, int8, int8_data)
         
         self.conf = conf  # Confidence threshold for detections
+        self.half = str(self.device).startswith("cuda")  # FP16 inference on CUDA tensor cores
         self.pose_detected = False  # Flag to track if pose was detected in current frame
+        self.fall_detected = False  # Read by the pusher's fall alert; no fall classifier sets it yet
         self.detection_count = 0  # Counter for total detections
         
+        # Per-source state for skipping inference on unchanged frames
+        self._prev_small = {}  # Downscaled grayscale copy of the last frame that ran through the model
+        self._last_results = {}  # Last detection result
+        
         # Create directory to save detected frames
+        self.save_frames = save_frames
         self.frames_dir = Path("detected_frames")
-        self.frames_dir.mkdir(exist_ok=True)
-        print(f"[detector] ✅ YOLOv8 Pose model loaded successfully")
-        print(f"[detector] Detected frames will be saved to: {self.frames_dir.absolute()}")
+        if self.save_frames:
+            self.frames_dir.mkdir(exist_ok=True)
+        
+        # Frames are encoded and written by a background thread so slow storage
+        # never stalls inference; the semaphore bounds the backlog. No thread when saving is off.
+        self._saver = None
+        self._save_slots = None
+        if self.save_frames:
+            self._saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-saver")
+            self._save_slots = threading.BoundedSemaphore(MAX_PENDING_SAVES)
+        print(f"[detector] ✅ YOLOv8 Pose model loaded successfully on {self.device}")
+        if self.save_frames:
+            print(f"[detector] Detected frames will be saved to: {self.frames_dir.absolute()}")
+        else:
+            print(f"[detector] Saving detected frames is disabled")
         
         self.keypoint_names = [
             "nose", "left_eye", "right_eye", "left_ear", "right_ear",
@@ -42,98 +107,269 @@ class YOLOv8PoseDetector:
             [8, 10], [9, 11], [2, 3], [1, 2], [1, 3],
             [2, 4], [3, 5], [4, 6], [5, 7]
         ]
+        # Same bones as 0-based keypoint indices, computed once for vectorized drawing
+        self.skeleton_idx = np.array(self.skeleton, dtype=np.intp) - 1
         
         self.skeleton_color = (0, 255, 255)
         self.keypoint_color = (0, 255, 0)
         self.keypoint_radius = 5
+        
+        self._warmup()
+
+    def _load_model(self, engine: str = None, export_engine: bool = False, openvino: bool = False,
+                    int8: bool = False, int8_data: str = None):
+        """
+        Load the pose model, preferring a TensorRT FP16 engine on CUDA devices
+        and an OpenVINO model on CPU.
+        
+        Args:
+            engine: Path to a prebuilt TensorRT .engine file (optional)
+            export_engine: Build an FP16 engine next to the weights once and reuse it
+            openvino: On CPU, export the weights to OpenVINO once and run through its runtime
+            int8: Quantize the OpenVINO model to INT8 (VNNI kernels), keeping FP32 as fallback
+            int8_data: Dataset YAML used for static INT8 calibration (required to export INT8)
+            
+        Returns:
+            YOLO model ready for inference
+        """
+        on_cuda = str(self.device).startswith("cuda")
+        
+        # Export once and cache the engine; later runs load the cached file
+        if on_cuda and not engine and export_engine:
+            cached_engine = Path(MODEL_WEIGHTS).with_suffix(".engine")
+            if not cached_engine.exists():
+                print(f"[detector] Exporting TensorRT FP16 engine to {cached_engine} (one-time)...")
+                # Dynamic batch axis so multi-camera batches fit the engine
+                YOLO(MODEL_WEIGHTS).export(format="engine", half=True, imgsz=INFERENCE_SIZE, device=self.device,
+                                           dynamic=self.batch > 1, batch=self.batch)
+            engine = str(cached_engine)
+        
+        if engine:
+            if on_cuda and Path(engine).exists():
+                print(f"[detector] ⚡ Using TensorRT engine: {engine}")
+                return YOLO(engine, task="pose")
+            print(f"[detector] ⚠️ TensorRT engine unavailable on {self.device}, using PyTorch weights")
+        
+        # OpenVINO's CPU kernels are much faster than PyTorch eager on Intel CPUs
+        if openvino and self.device == "cpu":
+            # INT8 first when requested, then FP32
+            for quantized in ([True, False] if int8 else [False]):
+                suffix = "_int8_openvino_model" if quantized else "_openvino_model"
+                try:
+                    openvino_dir = Path(f"{Path(MODEL_WEIGHTS).stem}{suffix}")
+                    if not openvino_dir.exists():
+                        # Without a local calibration set ultralytics would download COCO at startup
+                        if quantized and not int8_data:
+                            print(f"[detector] ⚠️ DETECTION_INT8_DATA not set, skipping INT8 export")
+                            continue
+                        precision = "INT8" if quantized else "FP32"
+                        print(f"[detector] Exporting {precision} OpenVINO model to {openvino_dir} (one-time)...")
+                        export_args = {"data": int8_data} if quantized else {}
+                        openvino_dir = Path(YOLO(MODEL_WEIGHTS).export(format="openvino", imgsz=INFERENCE_SIZE,
+                                                                       dynamic=self.batch > 1, int8=quantized,
+                                                                       **export_args))
+                    print(f"[detector] ⚡ Using OpenVINO model: {openvino_dir}")
+                    return YOLO(str(openvino_dir), task="pose")
+                except Exception as e:
+                    print(f"[detector] ⚠️ OpenVINO {'INT8 ' if quantized else ''}model unavailable ({e})")
+            print(f"[detector] ⚠️ Falling back to PyTorch weights")
+        
+        model = YOLO(MODEL_WEIGHTS)
+        try:
+            model.to(self.device)
+        except Exception as e:
+            # GPU init can fail on driver/runtime mismatches; keep running on CPU
+            print(f"[detector] ⚠️ Could not use {self.device} ({e}), falling back to CPU")
+            self.device = "cpu"
+            model.to(self.device)
+        
+        if str(self.device).startswith("cuda"):
+            # NHWC weights let cuDNN use tensor-core conv kernels with FP16
+            model.model.to(memory_format=torch.channels_last)
+            # TF32 tensor cores for any remaining FP32 matmuls/convs (Ampere and newer)
+            torch.set_float32_matmul_precision("high")
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
+        return model
+
+    def _warmup(self):
+        """
+        Run one inference on a blank frame so predictor setup and cuDNN algorithm
+        selection happen at startup instead of on the first live frame.
+        """
+        try:
+            self.model(np.zeros(WARMUP_SHAPE, dtype=np.uint8), conf=self.conf, half=self.half,
+                       imgsz=INFERENCE_SIZE, verbose=False)
+        except Exception as e:
+            print(f"[detector] ⚠️ Warm-up inference failed: {e}")
 
-    def annotate(self, bgr: np.ndarray) -> tuple:
+    def annotate(self, bgr: np.ndarray, source=None, inplace: bool = True) -> tuple:
         """
         Run pose detection on a frame and draw skeleton keypoints.
         
         Args:
             bgr: Input frame in BGR format (OpenCV format)
+            source: Stream identifier used to track unchanged frames (e.g. camera label)
+            inplace: Draw directly on the input frame instead of a copy
             
         Returns:
             tuple: (annotated_frame, pose_detected_flag)
         """
-        # Validate input frame
-        if bgr is None or bgr.size == 0:
-            return bgr, False
-            
-        try:
-            h, w = bgr.shape[:2]
-            output = bgr.copy()
+        return self.annotate_batch([bgr], [source], inplace=inplace)[0]
+
+    def annotate_batch(self, frames: list, sources: list = None, inplace: bool = True) -> list:
+        """
+        Run pose detection on several frames (e.g. one per camera) in a single forward pass.
+        Frames that barely changed since the previous frame of the same source reuse
+        the previous result instead of running the model.
+        
+        Args:
+            frames: List of input frames in BGR format
+            sources: Stream identifier per frame (defaults to the frame's position)
+            inplace: Draw directly on the input frames instead of copies
             
-            # Run YOLOv8 pose detection on the frame
-            results = self.model(bgr, conf=self.conf, verbose=False)
+        Returns:
+            list: (annotated_frame, pose_detected_flag) for each input frame, in order
+        """
+        if sources is None:
+            sources = list(range(len(frames)))
+        outputs = [(bgr, False) for bgr in frames]
+        
+        # Validate input frames; invalid ones are passed through untouched
+        valid = [i for i, bgr in enumerate(frames) if bgr is not None and bgr.size > 0]
+        if not valid:
+            return outputs
             
-            pose_detected = False
+        try:
+            # Reuse the last result for static frames, only run the model on the rest
+            to_run = []
+            thumbs = {}
+            for i in valid:
+                cached = self._last_results.get(sources[i])
+                thumbs[i] = self._motion_thumbnail(frames[i])
+                if cached is not None and self._is_static(sources[i], thumbs[i]):
+                    outputs[i] = self._draw_result(frames[i], cached, save=False, inplace=inplace)
+                else:
+                    to_run.append(i)
             
-            # Check if any poses were detected
-            if results and len(results) > 0:
-                result = results[0]
+            if to_run:
+                # Run YOLOv8 pose detection on all remaining frames at once
+                results = self.model([frames[i] for i in to_run], conf=self.conf, half=self.half,
+                                     imgsz=INFERENCE_SIZE, verbose=False)
                 
-                # If keypoints found, draw skeleton on frame
-                if result.keypoints is not None and len(result.keypoints) > 0:
-                    self.detection_count += 1
-                    print(f"[detector] 👤 POSE DETECTED! Count: {self.detection_count}")
-                    pose_detected = True
-                    
-                    # Extract keypoint coordinates and confidence scores
-                    keypoints = result.keypoints.xy.cpu().numpy()
-                    confidences = result.keypoints.conf.cpu().numpy() if result.keypoints.conf is not None else None
-                    
-                    # Draw skeleton for each detected person
-                    for person_idx, person_keypoints in enumerate(keypoints):
-                        person_conf = confidences[person_idx] if confidences is not None else None
-                        
-                        # Draw skeleton lines connecting keypoints
-                        for skeleton_pair in self.skeleton:
-                            pt1_idx, pt2_idx = skeleton_pair[0] - 1, skeleton_pair[1] - 1
-                            
-                            if pt1_idx < len(person_keypoints) and pt2_idx < len(person_keypoints):
-                                pt1 = person_keypoints[pt1_idx]
-                                pt2 = person_keypoints[pt2_idx]
-                                
-                                # Only draw if both points are valid (positive coordinates)
-                                if pt1[0] > 0 and pt1[1] > 0 and pt2[0] > 0 and pt2[1] > 0:
-                                    pt1 = (int(pt1[0]), int(pt1[1]))
-                                    pt2 = (int(pt2[0]), int(pt2[1]))
-                                    cv2.line(output, pt1, pt2, self.skeleton_color, 2)
-                        
-                        # Draw keypoint circles
-                        for kpt_idx, keypoint in enumerate(person_keypoints):
-                            if keypoint[0] > 0 and keypoint[1] > 0:
-                                kpt_conf = person_conf[kpt_idx] if person_conf is not None else 1.0
-                                # Only draw keypoint if confidence is above threshold
-                                if kpt_conf > 0.3:
-                                    pt = (int(keypoint[0]), int(keypoint[1]))
-                                    # Draw filled circle (green) with white border
-                                    cv2.circle(output, pt, self.keypoint_radius, self.keypoint_color, -1)
-                                    cv2.circle(output, pt, self.keypoint_radius, (255, 255, 255), 1)
-                    
-                    # Add text label to frame
-                    cv2.putText(output, "POSE DETECTED!", (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 2.0, (0, 255, 0), 4)
-                    
-                    # Save the annotated frame to disk
-                    try:
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-                        filename = self.frames_dir / f"pose_{self.detection_count}_{timestamp}.jpg"
-                        cv2.imwrite(str(filename), output)
-                        print(f"[detector] 💾 Frame saved: {filename}")
-                    except Exception as e:
-                        print(f"[detector] ⚠️ Failed to save frame: {e}")
+                for i, result in zip(to_run, results):
+                    self._last_results[sources[i]] = result
+                    self._prev_small[sources[i]] = thumbs[i]
+                    outputs[i] = self._draw_result(frames[i], result, inplace=inplace)
             
             # Update pose detection flag
-            self.pose_detected = pose_detected
-            return output, pose_detected
+            self.pose_detected = any(pose_detected for _, pose_detected in outputs)
+            return outputs
             
         except Exception as e:
             print(f"[detector] ❌ Error in annotate: {e}")
             import traceback
             traceback.print_exc()
-            return bgr, False
+            return [(bgr, False) for bgr in frames]
+
+    def _motion_thumbnail(self, bgr: np.ndarray):
+        """Downscaled grayscale copy of a frame for motion checks (None when motion skipping is off)."""
+        if self.motion_threshold <= 0:
+            return None
+        # Downscale first so the color conversion only touches the 80x60 thumbnail
+        return cv2.cvtColor(cv2.resize(bgr, MOTION_SIZE), cv2.COLOR_BGR2GRAY)
+
+    def _is_static(self, source, small) -> bool:
+        """Check whether a frame is nearly identical to the last frame of the same source that
+        ran through the model, i.e. whether that frame's cached result still applies."""
+        prev = self._prev_small.get(source)
+        if small is None or prev is None:
+            return False
+        return cv2.absdiff(small, prev).mean() < self.motion_threshold
+
+    def _draw_result(self, bgr: np.ndarray, result, save: bool = True, inplace: bool = True) -> tuple:
+        """
+        Draw the skeleton for one frame's detection result and save it if a pose was found.
+        
+        Args:
+            bgr: Frame to draw on
+            result: Ultralytics result for that frame
+            save: Count and save the detection (False when redrawing a reused result)
+            inplace: Draw directly on bgr instead of a copy
+            
+        Returns:
+            tuple: (annotated_frame, pose_detected_flag)
+        """
+        output = bgr if inplace else bgr.copy()
+        pose_detected = False
+        
+        # If keypoints found, draw skeleton on frame
+        if result.keypoints is not None and len(result.keypoints) > 0:
+            if save:
+                self.detection_count += 1
+                print(f"[detector] 👤 POSE DETECTED! Count: {self.detection_count}")
+            pose_detected = True
+            
+            # Extract keypoint coordinates and build validity masks for all people at once
+            keypoints = result.keypoints.xy.cpu().numpy()
+            points = keypoints.astype(np.int32)
+            valid = (keypoints > 0).all(axis=-1)  # Only positive coordinates are real keypoints
+            if result.keypoints.conf is not None:
+                # Only draw keypoint circles if confidence is above threshold
+                confident = valid & (result.keypoints.conf.cpu().numpy() > 0.3)
+            else:
+                confident = valid
+            num_keypoints = points.shape[1]
+            
+            # Draw skeleton lines for every detected person in a single polylines call
+            pairs = self.skeleton_idx
+            if pairs.max() >= num_keypoints:
+                pairs = pairs[(pairs < num_keypoints).all(axis=1)]
+            segments = points[:, pairs]  # (people, bones, 2 endpoints, xy)
+            segment_valid = valid[:, pairs].all(axis=-1)  # Only draw if both points are valid
+            if segment_valid.any():
+                cv2.polylines(output, list(segments[segment_valid]), False, self.skeleton_color, 2)
+            
+            # Draw keypoint circles
+            for pt in points[confident].tolist():
+                pt = tuple(pt)
+                # Draw filled circle (green) with white border
+                cv2.circle(output, pt, self.keypoint_radius, self.keypoint_color, -1)
+                cv2.circle(output, pt, self.keypoint_radius, (255, 255, 255), 1)
+            
+            # Add text label to frame
+            cv2.putText(output, POSE_LABEL, POSE_LABEL_ORG, POSE_LABEL_FONT, 2.0, (0, 255, 0), 4)
+            
+            # Save the annotated frame to disk (skips timestamp formatting and disk I/O when disabled)
+            if not (save and self.save_frames):
+                return output, pose_detected
+            if not self._save_slots.acquire(blocking=False):
+                print(f"[detector] ⚠️ Save queue full, dropping frame {self.detection_count}")
+                return output, pose_detected
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+            filename = self.frames_dir / f"pose_{self.detection_count}_{timestamp}.jpg"
+            # Copy once: the caller keeps using (and may overwrite) the output buffer
+            self._saver.submit(self._save_frame, filename, output.copy())
+        
+        return output, pose_detected
+
+    def _save_frame(self, filename: Path, bgr: np.ndarray):
+        """Write an annotated frame to disk (runs on the saver thread)."""
+        try:
+            self._write_jpeg(filename, bgr)
+            print(f"[detector] 💾 Frame saved: {filename}")
+        except Exception as e:
+            print(f"[detector] ⚠️ Failed to save frame: {e}")
+        finally:
+            self._save_slots.release()
+
+    @staticmethod
+    def _write_jpeg(filename: Path, bgr: np.ndarray):
+        """Encode a BGR frame as JPEG and write it to disk."""
+        if _turbojpeg is not None:
+            filename.write_bytes(_turbojpeg.encode(bgr, quality=95, pixel_format=TJPF_BGR))
+        else:
+            cv2.imwrite(str(filename), bgr)
 
 
 def load_detector_from_env():
@@ -141,6 +377,16 @@ def load_detector_from_env():
     if enable_detection != "1":
         return None
     conf = float(os.getenv("DETECTION_CONF", "0.5"))
-    device = os.getenv("DETECTION_DEVICE", "cpu")
-    return YOLOv8PoseDetector(conf=conf, device=device)
+    device = os.getenv("DETECTION_DEVICE", "auto")
+    engine = os.getenv("DETECTION_TRT_ENGINE")
+    export_engine = os.getenv("DETECTION_EXPORT_ENGINE", "0") == "1"
+    batch = int(os.getenv("DETECTION_BATCH_SIZE", "2"))
+    motion_threshold = float(os.getenv("DETECTION_MOTION_THRESHOLD", "2.0"))
+    save_frames = os.getenv("DETECTION_SAVE_FRAMES", "1") == "1"
+    openvino = os.getenv("DETECTION_OPENVINO", "0") == "1"
+    int8 = os.getenv("DETECTION_INT8", "0") == "1"
+    int8_data = os.getenv("DETECTION_INT8_DATA")
+    return YOLOv8PoseDetector(conf=conf, device=device, engine=engine, export_engine=export_engine, batch=batch,
+                              motion_threshold=motion_threshold, save_frames=save_frames, openvino=openvino,
+                              int8=int8, int8_data=int8_data)
 
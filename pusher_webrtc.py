@@ -3,15 +3,26 @@ WebRTC Pusher - Streams multiple RTSP cameras with YOLOv8 pose detection
 Sends video to a remote viewer via WebRTC with TURN relay support
 """
 import asyncio
+import atexit
+import contextlib
 import json
+import logging
+import logging.handlers
 import os
+import queue
+import re
+import socket
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from dotenv import load_dotenv
 from aiortc import (
     RTCPeerConnection,
     RTCSessionDescription,
     RTCConfiguration,
+    RTCIceCandidate,
     RTCIceServer,
+    RTCRtpSender,
     VideoStreamTrack,
 )
 from aiortc.contrib.media import MediaPlayer
@@ -22,9 +33,41 @@ import cv2
 import numpy as np
 from object_detection import load_detector_from_env
 
+# orjson when available; the signaling server reads text frames, so encode to str either way
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    json_dumps = partial(json.dumps, separators=(",", ":"))
+    json_loads = json.loads
+
 # Load environment variables from .env file
 load_dotenv()
 
+# Logging (LOGLEVEL=DEBUG for per-candidate / per-state-change detail).
+# LOGLEVEL applies to the pusher's own logger only; the root logger stays at
+# WARNING so aioice/aiortc INFO chatter (per-pair check states) isn't printed.
+# Records are queued on the event loop and written to stderr by a listener
+# thread, so a slow or redirected console never blocks signaling or media.
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter('[%(asctime)s] [PUSHER] %(levelname)s: %(message)s'))
+_log_handler = logging.handlers.QueueHandler(_log_queue)
+_log_handler.setFormatter(logging.Formatter('%(message)s'))  # final layout is applied by the listener
+logging.basicConfig(
+    level=logging.WARNING,
+    handlers=[_log_handler]
+)
+LOG_LISTENER = logging.handlers.QueueListener(_log_queue, _log_stream)
+LOG_LISTENER.start()
+atexit.register(LOG_LISTENER.stop)  # flush whatever is still queued on exit
+logger = logging.getLogger("pusher")
+logger.setLevel(os.getenv("LOGLEVEL", "INFO").upper())
+
 # ============ Configuration from .env file ============
 SIGNALING_WS = os.getenv("SIGNALING_WS")  # WebSocket server URL for signaling
 CAM_NAME = os.getenv("CAM_NAME", "camera1")  # Camera identifier
@@ -32,9 +75,74 @@ RTSP_URL_1 = os.getenv("RTSP_URL_1")  # First camera RTSP stream URL
 RTSP_URL_2 = os.getenv("RTSP_URL_2")  # Second camera RTSP stream URL
 VIEWER_ID = os.getenv("VIEWER_ID", "viewer1")  # Viewer identifier
 
+# ============ Signaling Configuration ============
+# Inbound messages above this size are decoded off the event loop so a big
+# multi-camera SDP doesn't stall the media tracks; small ones aren't worth the hop
+LARGE_MESSAGE_BYTES = 32 * 1024
+
 # ============ Detection Configuration ============
 ENABLE_DETECTION = os.getenv("ENABLE_DETECTION", "0").strip().lower() in ("1", "true", "yes", "on")
 DETECTION_FRAME_SKIP = int(os.getenv("DETECTION_FRAME_SKIP", "5"))  # Process every Nth frame (5 = every 5th frame)
+DETECTION_BATCH_SIZE = int(os.getenv("DETECTION_BATCH_SIZE", "2"))  # Frames per forward pass (one per camera)
+DETECTION_BATCH_WAIT_MS = float(os.getenv("DETECTION_BATCH_WAIT_MS", "10"))  # Max wait for a batch to fill
+
+# ============ Stream Configuration ============
+# Forward the camera's H.264 packets as-is (no decode/re-encode). Opt-in: only works
+# for H.264 cameras, and only when detection is off, since detection needs decoded pixels.
+RTSP_PASSTHROUGH = os.getenv("RTSP_PASSTHROUGH", "0").strip().lower() in ("1", "true", "yes", "on")
+PASSTHROUGH = RTSP_PASSTHROUGH and not ENABLE_DETECTION
+
+# ffmpeg demuxer options: TCP transport, 5s socket timeout, no input
+# buffering/reordering so packets are handed over as soon as they arrive, and a
+# minimal probe plus small realtime buffer for a fast first frame
+RTSP_OPTIONS = {
+    "rtsp_transport": "tcp",
+    "stimeout": "5000000",
+    "fflags": "nobuffer",
+    "flags": "low_delay",
+    "max_delay": "0",
+    "reorder_queue_size": "0",
+    "probesize": "32",
+    "analyzeduration": "0",
+    "rtbufsize": "100000",
+}
+
+# Frame-probe timeouts (seconds) tried in order when opening a camera
+PLAYER_PROBE_TIMEOUTS = (0.1, 0.5, 1.5, 3.0)
+
+# Single worker so detector calls stay serialized while running off the event loop
+DETECTION_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detector")
+
+# ============ ICE Candidate Parsing ============
+# foundation component protocol priority ip port typ type [raddr addr rport port] [tcptype type]
+CANDIDATE_RE = re.compile(
+    r"(?:candidate:)?(\S+) (\d+) (\S+) (\d+) (\S+) (\d+) typ (\S+)"
+    r"(?: raddr (\S+) rport (\d+))?(?:.*? tcptype (\S+))?"
+)
+
+
+def parse_candidate(candidate_str):
+    """Build an RTCIceCandidate from an SDP candidate line with one precompiled regex.
+    Falls back to aiortc's parser for anything the pattern doesn't cover."""
+    m = CANDIDATE_RE.match(candidate_str)
+    if m is None:
+        return candidate_from_sdp(candidate_str)
+    return RTCIceCandidate(
+        component=int(m[2]),
+        foundation=m[1],
+        ip=m[5],
+        port=int(m[6]),
+        priority=int(m[4]),
+        protocol=m[3],
+        type=m[7],
+        relatedAddress=m[8],
+        relatedPort=int(m[9]) if m[9] else None,
+        tcpType=m[10],
+    )
+
+
+# ============ Keep-alive Configuration ============
+KEEPALIVE_TICK = 1.0  # Seconds between keep-alive loop checks
 
 # ============ TURN Server Configuration (for NAT traversal) ============
 AWS_TURN_IP = os.getenv("AWS_TURN_IP")
@@ -43,12 +151,14 @@ AWS_TURN_USER = os.getenv("AWS_TURN_USER")
 AWS_TURN_PASS = os.getenv("AWS_TURN_PASS")
 
 # ============ ICE Servers Setup ============
-# Start with Google's public STUN server
-ICE_SERVERS = [RTCIceServer(urls="stun:stun.l.google.com:19302")]
+# Google's public STUN server; resolved in run(), and only when STUN is used
+STUN_HOST = "stun.l.google.com"
+STUN_PORT = 19302
 
-# Add TURN server if credentials are provided (for better NAT traversal)
+# TURN server if credentials are provided (for better NAT traversal)
+TURN_SERVERS = []
 if AWS_TURN_IP and AWS_TURN_PORT and AWS_TURN_USER and AWS_TURN_PASS:
-    ICE_SERVERS += [
+    TURN_SERVERS = [
         RTCIceServer(
             urls=f"turn:{AWS_TURN_IP}:{AWS_TURN_PORT}?transport=udp",
             username=AWS_TURN_USER,
@@ -61,6 +171,105 @@ if AWS_TURN_IP and AWS_TURN_PORT and AWS_TURN_USER and AWS_TURN_PASS:
         ),
     ]
 
+# ICE_MODE narrows which ICE servers are used:
+#   wan   - STUN + TURN (default)
+#   relay - TURN only, skips the STUN round-trip when traffic must be relayed anyway.
+#           aiortc has no iceTransportPolicy, so host candidates are still gathered.
+#   lan   - no ICE servers, host candidates only (same-network viewers)
+ICE_MODES = ("wan", "relay", "lan")
+ICE_MODE = os.getenv("ICE_MODE", "wan").strip().lower()
+if ICE_MODE not in ICE_MODES:
+    logger.warning("⚠️ Unknown ICE_MODE %r (expected one of %s), using wan", ICE_MODE, ", ".join(ICE_MODES))
+    ICE_MODE = "wan"
+if ICE_MODE == "relay" and not TURN_SERVERS:
+    logger.warning("⚠️ ICE_MODE=relay needs AWS_TURN_IP/PORT/USER/PASS; no TURN server configured, using wan")
+    ICE_MODE = "wan"
+
+
+async def resolve_ice_host(host, port):
+    """Resolve an ICE server hostname once per session, without blocking the event
+    loop, so gathering doesn't repeat the DNS lookup. Prefers an IPv4 address; keeps
+    the name (for aioice to resolve itself) if resolution fails or yields none."""
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+    except OSError:
+        return host
+    for family, _, _, _, sockaddr in infos:
+        if family == socket.AF_INET:
+            return sockaddr[0]
+    return host
+
+
+async def build_ice_servers():
+    """ICE servers for ICE_MODE; the STUN host is only looked up in wan mode."""
+    if ICE_MODE == "lan":
+        return []
+    if ICE_MODE == "relay":
+        return list(TURN_SERVERS)
+    stun_host = await resolve_ice_host(STUN_HOST, STUN_PORT)
+    return [RTCIceServer(urls=f"stun:{stun_host}:{STUN_PORT}")] + TURN_SERVERS
+
+
+class DetectionBatcher:
+    """
+    Collects frames from several camera tracks and runs them through the
+    detector in a single forward pass instead of one pass per camera.
+    
+    Args:
+        detector: YOLOv8PoseDetector instance
+        batch_size: Max frames per forward pass (usually the number of cameras)
+        max_wait_ms: How long the first queued frame waits for others to join the batch
+    """
+    def __init__(self, detector, batch_size: int = 2, max_wait_ms: float = 10.0):
+        self.detector = detector
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    async def annotate(self, bgr, source=None):
+        """Submit a frame to the next batch and wait for its (annotated_frame, pose_detected) result"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((bgr, source, future))
+        return await future
+
+    async def _run(self):
+        """Drain the queue into batches of up to batch_size frames"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            
+            frames = [bgr for bgr, _, _ in batch]
+            sources = [source for _, source, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    DETECTION_EXECUTOR, self.detector.annotate_batch, frames, sources
+                )
+            except Exception as e:
+                logger.error("❌ Batched detection error (%d frames): %s", len(frames), e)
+                results = [(bgr, False) for bgr in frames]
+            
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def close(self):
+        """Stop the batching task"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
 
 class ProxyVideoTrack(VideoStreamTrack):
     """
@@ -72,14 +281,18 @@ class ProxyVideoTrack(VideoStreamTrack):
         label: Camera label (e.g., "cam1", "cam2")
         detector: YOLOv8PoseDetector instance (optional)
         frame_skip: Skip N frames between detections (e.g., 5 = detect every 5th frame)
+        batcher: DetectionBatcher shared across cameras (optional)
     """
-    def __init__(self, source_track, label, detector=None, frame_skip: int = 0):
+    def __init__(self, source_track, label, detector=None, frame_skip: int = 0, batcher=None):
         super().__init__()
         self.source = source_track
         self.label = label
         # Use label as the ID to ensure uniqueness across tracks
         self._id = label
+        # Resolved once; aiortc reads kind on every sender/transceiver lookup
+        self._kind = getattr(source_track, "kind", "video")
         self.detector = detector
+        self.batcher = batcher
         self.frame_skip = max(0, int(frame_skip))
         self._frame_index = 0
 
@@ -91,7 +304,7 @@ class ProxyVideoTrack(VideoStreamTrack):
     @property
     def kind(self):
         """Return track kind (always 'video')"""
-        return getattr(self.source, "kind", "video")
+        return self._kind
 
     async def recv(self):
         """
@@ -113,131 +326,180 @@ class ProxyVideoTrack(VideoStreamTrack):
             if self.frame_skip and (idx % (self.frame_skip + 1)) != 0:
                 return frame
             
+            # Pixel conversion and inference run in worker threads so the event loop
+            # keeps pumping the other tracks and signaling meanwhile
+            loop = asyncio.get_running_loop()
+            
             # Convert frame to OpenCV format (BGR)
-            bgr = frame.to_ndarray(format="bgr24")
+            bgr = await loop.run_in_executor(None, partial(frame.to_ndarray, format="bgr24"))
             if bgr is None or bgr.size == 0:
                 return frame
             
             # Run pose detection on the frame  , yolo v8 pose detection while live detection
-            annotated_bgr, pose_detected = self.detector.annotate(bgr)
+            # (batched with the other cameras when a batcher is shared)
+            if self.batcher:
+                annotated_bgr, pose_detected = await self.batcher.annotate(bgr, self.label)
+            else:
+                annotated_bgr, pose_detected = await loop.run_in_executor(
+                    DETECTION_EXECUTOR, self.detector.annotate, bgr, self.label
+                )
             
             # Validate annotated frame
             if annotated_bgr is None or annotated_bgr.size == 0:
                 return frame
             
             # Convert back to VideoFrame format for WebRTC
-            new_frame = VideoFrame.from_ndarray(annotated_bgr, format="bgr24")
+            new_frame = await loop.run_in_executor(
+                None, partial(VideoFrame.from_ndarray, annotated_bgr, format="bgr24")
+            )
             new_frame.pts = frame.pts
             new_frame.time_base = frame.time_base
             
             return new_frame
             
         except Exception as e:
-            print(f"[pusher] ❌ Detection error on {self.label} frame {idx}: {e}")
+            logger.error("❌ Detection error on %s frame %s: %s", self.label, idx, e)
             return frame
 
 
+def prefer_h264(transceiver):
+    """Restrict a transceiver to H.264 so passthrough packets are sent without re-encoding."""
+    codecs = RTCRtpSender.getCapabilities("video").codecs
+    h264 = [c for c in codecs if c.mimeType.lower() == "video/h264"]
+    if h264:
+        transceiver.setCodecPreferences(h264)
+
+
+def dedupe_sdp_candidates(sdp):
+    """Drop a=candidate lines that repeat a transport address already listed in the
+    same media section (e.g. a srflx equal to the host address). The first entry is
+    kept; aiortc lists host candidates first."""
+    lines = sdp.split("\r\n")
+    kept = []
+    seen = set()
+    for line in lines:
+        if line.startswith("m="):
+            seen = set()
+        elif line.startswith("a=candidate:"):
+            bits = line.split()
+            if len(bits) >= 6:
+                # component, protocol, address, port
+                key = (bits[1], bits[2].lower(), bits[4], bits[5])
+                if key in seen:
+                    continue
+                seen.add(key)
+        kept.append(line)
+    return "\r\n".join(kept)
+
+
 async def check_player_frames(player, label, timeout=3.0):
     """Try to receive a single frame from player.video to ensure the RTSP source is healthy."""
     if not getattr(player, "video", None):
-        print(f"[debug] {label}: No video attribute on player")
+        logger.debug("%s: No video attribute on player", label)
         return False
     try:
         frame = await asyncio.wait_for(player.video.recv(), timeout=timeout)
         if frame is None:
-            print(f"[debug] {label}: recv returned None")
+            logger.debug("%s: recv returned None", label)
             return False
-        print(f"[debug] {label}: got frame pts={getattr(frame, 'pts', '?')} size={getattr(frame,'width','?')}x{getattr(frame,'height','?')}")
+        logger.debug("%s: got frame pts=%s size=%sx%s", label, getattr(frame, 'pts', '?'),
+                     getattr(frame, 'width', '?'), getattr(frame, 'height', '?'))
         return True
     except asyncio.TimeoutError:
-        print(f"[debug] {label}: recv() timed out after {timeout}s")
+        logger.debug("%s: recv() timed out after %ss", label, timeout)
         return False
     except Exception as e:
-        print(f"[debug] {label}: recv() exception: {e}")
+        logger.debug("%s: recv() exception: %s", label, e)
         return False
 
 
 async def run():
-    pc = RTCPeerConnection(configuration=RTCConfiguration(iceServers=ICE_SERVERS))
-    print(f"[pusher] PeerConnection created. TURN: {AWS_TURN_IP}:{AWS_TURN_PORT if AWS_TURN_IP else ''}")
+    pc = RTCPeerConnection(configuration=RTCConfiguration(iceServers=await build_ice_servers()))
+    logger.info("PeerConnection created. TURN: %s:%s", AWS_TURN_IP, AWS_TURN_PORT if AWS_TURN_IP else '')
 
     @pc.on("iceconnectionstatechange")
     def on_ice_state():
-        print("[pusher] ICE state:", pc.iceConnectionState)
+        logger.debug("ICE state: %s", pc.iceConnectionState)
 
     @pc.on("connectionstatechange")
     def on_conn_state():
-        print("[pusher] Connection state:", pc.connectionState)
+        logger.info("Connection state: %s", pc.connectionState)
         if pc.connectionState == "failed":
-            print("[pusher] ⚠️ Connection failed, will attempt to recover")
+            logger.warning("⚠️ Connection failed, will attempt to recover")
         elif pc.connectionState == "disconnected":
-            print("[pusher] ⚠️ Connection disconnected, waiting for reconnection")
+            logger.warning("⚠️ Connection disconnected, waiting for reconnection")
 
     @pc.on("icegatheringstatechange")
     def on_gather_state():
-        print("[pusher] ICE gathering state:", pc.iceGatheringState)
+        logger.debug("ICE gathering state: %s", pc.iceGatheringState)
 
     players = []
     detector = None
-    last_fall_alert_time = 0
+    batcher = None
+    last_fall_alert_time = float("-inf")
     
     # Load YOLOv8 pose detector if detection is enabled
     if ENABLE_DETECTION:
         try:
             detector = load_detector_from_env()
             if detector:
-                print("[pusher] ✅ YOLOv8 Pose detector loaded")
+                logger.info("✅ YOLOv8 Pose detector loaded")
+                if DETECTION_BATCH_SIZE > 1:
+                    batcher = DetectionBatcher(detector, DETECTION_BATCH_SIZE, DETECTION_BATCH_WAIT_MS)
+                    logger.info("Batching detection across up to %d cameras", DETECTION_BATCH_SIZE)
             else:
-                print("[pusher] ⚠️ Detection disabled")
+                logger.warning("⚠️ Detection disabled")
         except Exception as e:
-            print(f"[pusher] ❌ Detector error: {e}")
+            logger.error("❌ Detector error: %s", e)
 
     async def create_player(rtsp_url, label):
         try:
-            print(f"[pusher] Creating MediaPlayer for {label}: {rtsp_url}")
-            player = MediaPlayer(rtsp_url, format="rtsp",
-                                 options={"rtsp_transport":"tcp", "stimeout":"5000000"})
-            await asyncio.sleep(0.5)  # allow ffmpeg to spin up
-            ok = await check_player_frames(player, label, timeout=3.0)
+            logger.info("Creating MediaPlayer for %s: %s", label, rtsp_url)
+            # MediaPlayer runs av.open() (RTSP connect/DESCRIBE/SETUP) in its constructor,
+            # so build it in a worker thread: cameras then connect in parallel and an
+            # unreachable one doesn't block the event loop for the whole socket timeout
+            player = await asyncio.get_running_loop().run_in_executor(
+                None, partial(MediaPlayer, rtsp_url, format="rtsp",
+                              options=RTSP_OPTIONS, decode=not PASSTHROUGH)
+            )
+            if PASSTHROUGH:
+                # The probe would consume the first packets, which may hold the only
+                # keyframe until the next GOP, so passthrough players go out unprobed
+                logger.info("%s: passthrough, skipping frame probe", label)
+                players.append((label, player))
+                return (label, player, True)
+            # Probe with a short timeout first so a warm stream is accepted immediately,
+            # backing off only while ffmpeg is still spinning up
+            ok = False
+            for timeout in PLAYER_PROBE_TIMEOUTS:
+                ok = await check_player_frames(player, label, timeout=timeout)
+                if ok:
+                    break
             if not ok:
-                # try one more short retry
-                print(f"[pusher] {label}: retrying frame check")
-                await asyncio.sleep(1.0)
-                ok = await check_player_frames(player, label, timeout=3.0)
-            if not ok:
-                print(f"[pusher] ⚠️ {label}: no frames detected (RTSP may be wrong or camera offline)")
+                logger.warning("⚠️ %s: no frames detected (RTSP may be wrong or camera offline)", label)
             else:
-                print(f"[pusher] ✅ {label}: frames detected")
+                logger.info("✅ %s: frames detected", label)
             players.append((label, player))
             return (label, player, ok)
         except Exception as e:
-            print(f"[pusher] ❌ Error creating player for {label}: {e}")
+            logger.error("❌ Error creating player for %s: %s", label, e)
             return (label, None, False)
 
-    # create players
-    info1 = await create_player(RTSP_URL_1, "cam1")
-    info2 = await create_player(RTSP_URL_2, "cam2")
-
-    # If no players, exit
-    if info1[1] is None and info2[1] is None:
-        print("[pusher] ❌ No players created, exiting")
-        await pc.close()
-        return
-
     # Add separate transceivers: one per camera. This forces separate m=video lines in SDP.
     async def add_transceiver_for(player_tuple):
         label, player = player_tuple
         if player is None:
-            print(f"[pusher] Skipping {label}: player is None")
+            logger.info("Skipping %s: player is None", label)
             return False
         try:
-            proxied = ProxyVideoTrack(player.video, label, detector=detector, frame_skip=DETECTION_FRAME_SKIP)
+            proxied = ProxyVideoTrack(player.video, label, detector=detector, frame_skip=DETECTION_FRAME_SKIP,
+                                      batcher=batcher)
             # Preferred approach: add a separate transceiver for each track.
             # We attempt to attach proxied directly to addTransceiver if supported.
             try:
                 transceiver = pc.addTransceiver(proxied, direction="sendonly")
                 # Some aiortc versions return a transceiver; the sender will be created.
-                print(f"[pusher] Added transceiver for {label}. transceiver={transceiver}")
+                logger.info("Added transceiver for %s. transceiver=%s", label, transceiver)
             except TypeError:
                 # Fallback: add transceiver by kind, then replace sender.track
                 transceiver = pc.addTransceiver(kind="video", direction="sendonly")
@@ -245,170 +507,215 @@ async def run():
                 try:
                     # replace_track may be available; try it.
                     await sender.replace_track(proxied)
-                    print(f"[pusher] Replaced transceiver sender.track for {label}")
+                    logger.info("Replaced transceiver sender.track for %s", label)
                 except Exception:
                     # fallback to addTrack (less ideal)
                     sender = pc.addTrack(proxied)
-                    print(f"[pusher] Fallback: used addTrack for {label}; sender={sender}")
+                    logger.info("Fallback: used addTrack for %s; sender=%s", label, sender)
+            # Passthrough packets are already H.264, so H.264 must be the negotiated codec
+            if PASSTHROUGH:
+                try:
+                    prefer_h264(transceiver)
+                except Exception as e:
+                    logger.warning("⚠️ Could not force H.264 for %s: %s", label, e)
             # Log sender info if possible
             try:
                 s = transceiver.sender
-                print(f"[pusher] sender for {label}: id={getattr(s,'id',None)} track={getattr(s,'track',None)}")
+                logger.debug("sender for %s: id=%s track=%s", label, getattr(s, 'id', None), getattr(s, 'track', None))
             except Exception:
                 pass
             return True
         except Exception as e:
-            print(f"[pusher] ❌ Error adding transceiver for {label}: {e}")
+            logger.error("❌ Error adding transceiver for %s: %s", label, e)
             return False
 
-    # Add transceivers for each created player
-    added1 = await add_transceiver_for((info1[0], info1[1]))
-    added2 = await add_transceiver_for((info2[0], info2[1]))
-
-    print(f"[pusher] Completed adding transceivers: cam1_added={added1}, cam2_added={added2}")
-
-    # Connect signaling
+    # Start the signaling handshake now so it overlaps the RTSP setup below. This relies
+    # on create_player opening the cameras in the executor: the loop stays free to
+    # answer keepalive pings, so the open socket can't time out while ffmpeg connects.
     ws_url = SIGNALING_WS.rstrip("/") + "/" + CAM_NAME
-    print("[pusher] Connecting to signaling server:", ws_url)
+    logger.info("Connecting to signaling server: %s", ws_url)
+    # ping_interval + ping_timeout is the dead-peer detection budget (~10s)
+    ws_connect_task = asyncio.ensure_future(websockets.connect(
+        ws_url,
+        ping_interval=5,
+        ping_timeout=5,
+        close_timeout=5,
+        max_queue=64,  # headroom for candidate bursts
+        write_limit=2 ** 16,
+        compression=None,  # the signaling server doesn't negotiate permessage-deflate
+    ))
+
+    async def close_signaling():
+        """Close the signaling websocket, or abandon the handshake if it is still pending."""
+        if not ws_connect_task.done():
+            ws_connect_task.cancel()
+        elif not ws_connect_task.cancelled() and ws_connect_task.exception() is None:
+            await ws_connect_task.result().close()
+
+    # Create players concurrently and add each camera's transceiver as soon as its
+    # RTSP probe finishes, so one slow camera doesn't hold up the others
+    cams = [(RTSP_URL_1, "cam1"), (RTSP_URL_2, "cam2")]
+    player_tasks = [asyncio.create_task(create_player(url, label)) for url, label in cams]
+    added = {}
+    for next_ready in asyncio.as_completed(player_tasks):
+        label, player, ok = await next_ready
+        added[label] = await add_transceiver_for((label, player))
 
-    try:
-        async with websockets.connect(ws_url, ping_interval=20, ping_timeout=10, close_timeout=5) as ws:
-            print("[pusher] ✅ Signaling connected")
+    # If no players, exit
+    if not players:
+        logger.error("❌ No players created, exiting")
+        await close_signaling()
+        await pc.close()
+        return
 
-            @pc.on("icecandidate")
-            async def on_local_ice(candidate):
-                try:
-                    if candidate is None:
-                        print("[pusher] ✅ Local ICE gathering finished")
-                        await ws.send(json.dumps({"type":"ice","from":CAM_NAME,"to":VIEWER_ID,"candidate":{}}))
-                        return
-                    if "relay" in candidate.to_sdp():
-                        print("[pusher] 🔄 Sending TURN candidate")
-                    msg = {
-                        "type":"ice",
-                        "from": CAM_NAME,
-                        "to": VIEWER_ID,
-                        "candidate": {
-                            "candidate": candidate.to_sdp(),
-                            "sdpMid": candidate.sdpMid,
-                            "sdpMLineIndex": candidate.sdpMLineIndex
-                        }
-                    }
-                    await ws.send(json.dumps(msg))
-                    print("[pusher] Sent ICE candidate")
-                except Exception as e:
-                    print("[pusher] ❌ Error sending ICE candidate:", e)
+    logger.info("Completed adding transceivers: %s", ", ".join(f"{label}_added={ok}" for label, ok in added.items()))
 
-            # create offer
-            print("[pusher] Creating SDP offer...")
+    try:
+        async with contextlib.AsyncExitStack() as stack:
+            stack.push_async_callback(close_signaling)
+
+            loop = asyncio.get_running_loop()
+
+            # No local "icecandidate" handler: aiortc never emits that event. It gathers
+            # every candidate inside setLocalDescription and embeds them in the offer SDP
+            # (deduplicated by dedupe_sdp_candidates), so nothing is trickled from here.
+
+            async def add_remote_candidate(candidate_data):
+                candidate_str = (candidate_data or {}).get("candidate")
+                if not candidate_str:
+                    await pc.addIceCandidate(None)
+                    logger.debug("✅ Remote ICE end (added None)")
+                    return
+                candidate = parse_candidate(candidate_str)
+                candidate.sdpMid = candidate_data.get("sdpMid")
+                candidate.sdpMLineIndex = candidate_data.get("sdpMLineIndex")
+                await pc.addIceCandidate(candidate)
+
+            # create offer; ICE gathering (STUN/TURN round-trips) runs while the
+            # signaling handshake may still be in flight
+            logger.info("Creating SDP offer...")
             offer = await pc.createOffer()
             await pc.setLocalDescription(offer)
-            print("[pusher] Local description (offer) set. Printing short SDP for debug:")
-            sdp = pc.localDescription.sdp
-            print("----- SDP START (first 1600 chars) -----")
-            print(sdp[:1600])
-            print("----- SDP END -----")
+            logger.info("Local description (offer) set")
+            logger.debug("----- SDP START (first 1600 chars) -----\n%s\n----- SDP END -----",
+                         pc.localDescription.sdp[:1600])
+
+            ws = await ws_connect_task
+            logger.info("✅ Signaling connected")
 
             # send offer
-            offer_msg = {"type":"offer","from": CAM_NAME, "to": VIEWER_ID, "sdp": pc.localDescription.sdp}
-            await ws.send(json.dumps(offer_msg))
-            print("[pusher] ✅ Offer sent to viewer")
+            offer_msg = {"type":"offer","from": CAM_NAME, "to": VIEWER_ID,
+                         "sdp": dedupe_sdp_candidates(pc.localDescription.sdp)}
+            await ws.send(json_dumps(offer_msg))
+            logger.info("✅ Offer sent to viewer")
 
             # Keep track of connection state
             connection_established = False
-            last_activity = time.time()
+            last_activity = time.monotonic()
+
+            async def handle_answer(message):
+                nonlocal connection_established
+                logger.info("Received answer: setting remote description")
+                try:
+                    answer = RTCSessionDescription(sdp=message["sdp"], type="answer")
+                    await pc.setRemoteDescription(answer)
+                    logger.info("✅ Remote description set")
+                    connection_established = True
+                except Exception as e:
+                    logger.error("❌ setRemoteDescription failed: %s", e)
+
+            async def handle_ice(message):
+                try:
+                    await add_remote_candidate(message.get("candidate"))
+                    logger.debug("Added remote ICE candidate")
+                except Exception as e:
+                    logger.warning("⚠️ Failed to add remote ICE: %s", e)
+
+            async def handle_ice_batch(message):
+                candidates = message.get("candidates") or []
+                for candidate_data in candidates:
+                    try:
+                        await add_remote_candidate(candidate_data)
+                    except Exception as e:
+                        logger.warning("⚠️ Failed to add remote ICE: %s", e)
+                logger.debug("Added %d remote ICE candidate(s)", len(candidates))
+
+            # One dict lookup per message instead of walking an if/elif chain
+            handlers = {
+                "answer": handle_answer,
+                "ice": handle_ice,
+                "ice-batch": handle_ice_batch,
+            }
 
             # handle incoming messages with keep-alive
             try:
                 async for raw in ws:
-                    last_activity = time.time()
+                    last_activity = time.monotonic()
                     try:
-                        message = json.loads(raw)
+                        if len(raw) > LARGE_MESSAGE_BYTES:
+                            message = await loop.run_in_executor(None, json_loads, raw)
+                        else:
+                            message = json_loads(raw)
                     except Exception as e:
-                        print("[pusher] ⚠️ Invalid JSON:", e)
+                        logger.warning("⚠️ Invalid JSON: %s", e)
                         continue
 
                     typ = message.get("type")
-                    if typ == "answer":
-                        print("[pusher] Received answer: setting remote description")
-                        try:
-                            answer = RTCSessionDescription(sdp=message["sdp"], type="answer")
-                            await pc.setRemoteDescription(answer)
-                            print("[pusher] ✅ Remote description set")
-                            connection_established = True
-                        except Exception as e:
-                            print("[pusher] ❌ setRemoteDescription failed:", e)
-                    elif typ == "ice":
-                        try:
-                            candidate_data = message.get("candidate") or {}
-                            candidate_str = candidate_data.get("candidate")
-                            if not candidate_str:
-                                await pc.addIceCandidate(None)
-                                print("[pusher] ✅ Remote ICE end (added None)")
-                                continue
-                            candidate = candidate_from_sdp(candidate_str)
-                            candidate.sdpMid = candidate_data.get("sdpMid")
-                            candidate.sdpMLineIndex = candidate_data.get("sdpMLineIndex")
-                            await pc.addIceCandidate(candidate)
-                            print("[pusher] Added remote ICE candidate")
-                        except Exception as e:
-                            print("[pusher] ⚠️ Failed to add remote ICE:", e)
+                    handler = handlers.get(typ)
+                    if handler is not None:
+                        await handler(message)
                     else:
-                        print("[pusher] ⚠️ Unknown message type:", typ)
+                        logger.warning("⚠️ Unknown message type: %s", typ)
             except asyncio.CancelledError:
-                print("[pusher] Message handling cancelled")
+                logger.info("Message handling cancelled")
                 raise
             finally:
                 # Keep connection alive indefinitely
                 if connection_established:
-                    print("[pusher] ✅ Connection established, maintaining stream indefinitely...")
+                    logger.info("✅ Connection established, maintaining stream indefinitely...")
                     try:
-                        # Keep the connection open - send heartbeat periodically
-                        last_heartbeat = time.time()
+                        # Keep the connection open; websockets' own ping_interval keeps the
+                        # signaling socket alive and detects a dead peer
+                        # Tick on a fixed 1s cadence: sleep only the time left until the next
+                        # deadline so send/check time doesn't stretch the interval
+                        next_tick = time.monotonic()
                         while pc.connectionState not in ["closed", "failed"]:
-                            await asyncio.sleep(1)
-                            current_time = time.time()
+                            next_tick += KEEPALIVE_TICK
+                            delay = next_tick - time.monotonic()
+                            if delay > 0:
+                                await asyncio.sleep(delay)
+                            else:
+                                next_tick = time.monotonic()
+                            current_time = time.monotonic()
                             
                             # Check for fall detection and send alert
                             if detector and detector.fall_detected:
                                 if current_time - last_fall_alert_time > 3:
                                     try:
                                         if ws and not ws.closed:
-                                            await ws.send(json.dumps({
+                                            await ws.send(json_dumps({
                                                 "type": "fall_alert",
                                                 "from": CAM_NAME,
                                                 "to": VIEWER_ID
                                             }))
-                                            print("[pusher] 🚨 Fall alert sent to viewer")
+                                            logger.warning("🚨 Fall alert sent to viewer")
                                             last_fall_alert_time = current_time
                                     except Exception as e:
-                                        print(f"[pusher] Fall alert send failed: {e}")
-                            
-                            # Send keep-alive ping every 10 seconds to maintain signaling connection
-                            if current_time - last_heartbeat > 10:
-                                try:
-                                    if ws and not ws.closed:
-                                        await ws.send(json.dumps({
-                                            "type": "ping",
-                                            "from": CAM_NAME,
-                                            "to": VIEWER_ID
-                                        }))
-                                        last_heartbeat = current_time
-                                except Exception as e:
-                                    print(f"[pusher] Keep-alive ping failed: {e}")
-                                    break
+                                        logger.error("Fall alert send failed: %s", e)
                             
                             # Monitor connection state
                             if pc.connectionState == "disconnected":
-                                print("[pusher] ⚠️ Connection disconnected, attempting recovery...")
+                                logger.warning("⚠️ Connection disconnected, attempting recovery...")
                                 await asyncio.sleep(2)
                     except Exception as e:
-                        print(f"[pusher] Keep-alive loop error: {e}")
+                        logger.error("Keep-alive loop error: %s", e)
 
     except Exception as e:
-        print("[pusher] ❌ Signaling/WS exception:", e)
+        logger.error("❌ Signaling/WS exception: %s", e)
     finally:
-        print("[pusher] Closing peer connection")
+        logger.info("Closing peer connection")
+        if batcher:
+            batcher.close()
         await pc.close()
 
 
@@ -419,12 +726,33 @@ if __name__ == "__main__":
     print(f"RTSP 1: {RTSP_URL_1}")
     print(f"RTSP 2: {RTSP_URL_2}")
     print(f"Detection: {'ENABLED' if ENABLE_DETECTION else 'DISABLED'}")
+    print(f"ICE Mode: {ICE_MODE}")
+    print(f"H.264 Passthrough: {'ENABLED' if PASSTHROUGH else 'DISABLED'}")
     print(f"Frame Skip: {DETECTION_FRAME_SKIP}")
     print("="*60)
+    # Opt-in profiling: PUSHER_PROFILE=1 writes cumulative stats to pusher.prof on exit
+    if os.getenv("PUSHER_PROFILE") == "1":
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        @atexit.register
+        def dump_profile():
+            profiler.disable()
+            pstats.Stats(profiler).sort_stats("cumulative").dump_stats("pusher.prof")
+            logger.info("Profile written to pusher.prof")
+
+    # libuv-backed loop where available; the stock asyncio loop otherwise
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     try:
         asyncio.run(run())
     except KeyboardInterrupt:
-        print("\n[pusher] Stopped by user")
+        logger.info("Stopped by user")
     except Exception as e:
-        print("[pusher] Fatal:", e)
+        logger.critical("Fatal: %s", e)
 
@@ -1,31 +1,63 @@
 # # server_signaling.py
 import asyncio
+import atexit
+import contextlib
+import importlib.util
 import json
 import logging
+import logging.handlers
+import queue
 from typing import Dict, Set
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, Response
 from pathlib import Path
 import uvicorn
 
-# Logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] [SIGNALING] %(levelname)s: %(message)s'
-)
+# orjson when available; messages are relayed as text frames, so encode to str either way
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    json_dumps = json.dumps
+    json_loads = json.loads
+
+# Logging: records are queued by the request handlers and written by a listener
+# thread, so console I/O never stalls the event loop. Guarded because uvicorn
+# imports this module a second time as "server_signaling".
+if not logging.root.handlers:
+    _log_queue = queue.SimpleQueue()
+    _log_stream = logging.StreamHandler()
+    _log_stream.setFormatter(logging.Formatter('[%(asctime)s] [SIGNALING] %(levelname)s: %(message)s'))
+    _log_handler = logging.handlers.QueueHandler(_log_queue)
+    _log_handler.setFormatter(logging.Formatter('%(message)s'))  # final layout is applied by the listener
+    logging.basicConfig(level=logging.INFO, handlers=[_log_handler])
+    _log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)  # flush whatever is still queued on exit
 logger = logging.getLogger(__name__)
 
-# FastAPI app
-app = FastAPI()
+# FastAPI app; JSON endpoints serialize with orjson when it is installed
+app = FastAPI(default_response_class=ORJSONResponse if orjson else JSONResponse)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
 # Serve viewer.html
 BASE_DIR = Path(__file__).resolve().parent
 VIEWER_FILE = BASE_DIR / "viewer.html"
+# Static bodies, built once at import instead of per request
+VIEWER_HTML = VIEWER_FILE.read_text(encoding="utf-8") if VIEWER_FILE.exists() else None
+ROOT_BODY = json_dumps({"message": "Signaling server running"})
 
 # Global state - track clients and their subscriptions
 class ClientState:
+    __slots__ = ("client_id", "websocket", "is_camera", "subscribed_cameras",
+                 "last_offer", "last_answer", "outbox", "sender_task")
+
     def __init__(self, client_id: str, websocket: WebSocket):
         self.client_id = client_id
         self.websocket = websocket
@@ -33,20 +65,74 @@ class ClientState:
         self.subscribed_cameras: Set[str] = set()
         self.last_offer: str = None
         self.last_answer: str = None
+        # Viewers only: bounded outbox drained by a dedicated sender task
+        self.outbox: asyncio.Queue = None
+        self.sender_task: asyncio.Task = None
 
 clients: Dict[str, ClientState] = {}
+# Viewer subset of clients, partitioned at connect time so offer broadcasts
+# iterate only viewers instead of filtering every client
+viewers: Dict[str, ClientState] = {}
+
+# Broadcast messages waiting per viewer before the oldest is dropped
+VIEWER_OUTBOX_SIZE = 32
+# A peer that can't take a message within this many seconds is disconnected
+SEND_TIMEOUT = 2.0
+
+async def send_to_peer(peer: ClientState, data: str):
+    """Send to another client without letting a stuck socket hold up the sender.
+    On timeout the peer is closed (its own endpoint loop then cleans it up) and
+    the TimeoutError propagates to the caller's error handling."""
+    try:
+        await asyncio.wait_for(peer.websocket.send_text(data), SEND_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"⏱️ '{peer.client_id}' did not accept data within {SEND_TIMEOUT}s, closing")
+        with contextlib.suppress(Exception):
+            await asyncio.wait_for(peer.websocket.close(code=1011), SEND_TIMEOUT)
+        raise
+
+async def viewer_sender(viewer: ClientState):
+    """Drain a viewer's outbox onto its socket; stops at the first send failure."""
+    while True:
+        data = await viewer.outbox.get()
+        try:
+            await send_to_peer(viewer, data)
+            logger.info(f"📤 Broadcast offer to viewer '{viewer.client_id}'")
+        except Exception as e:
+            logger.error(f"❌ Failed to broadcast to {viewer.client_id}: {e}")
+            return
+
+def broadcast_to_viewers(data: str):
+    """Queue data for every viewer without awaiting socket I/O. A viewer whose
+    outbox is full loses its oldest message, so the latest offer always wins."""
+    for viewer in viewers.values():
+        try:
+            viewer.outbox.put_nowait(data)
+        except asyncio.QueueFull:
+            viewer.outbox.get_nowait()
+            viewer.outbox.put_nowait(data)
+
+# Messages relayed verbatim to their target peer
+ICE_MESSAGE_TYPES = frozenset(("ice", "ice-batch", "ice-complete"))
+
+# Reply to heartbeat pings; constant, so serialized once
+PONG_MSG = json_dumps({"type": "pong", "from": "signaling"})
 
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     """Enhanced signaling with multi-viewer support and connection stability"""
     await websocket.accept()
     
-    is_camera = client_id.startswith("camera")
+    client = ClientState(client_id, websocket)
+    is_camera = client.is_camera  # role is derived once, in ClientState
     role = "🎥 Camera" if is_camera else "👁️ Viewer"
     
     logger.info(f"✅ {role} '{client_id}' connected")
-    client = ClientState(client_id, websocket)
     clients[client_id] = client
+    if not is_camera:
+        client.outbox = asyncio.Queue(maxsize=VIEWER_OUTBOX_SIZE)
+        client.sender_task = asyncio.create_task(viewer_sender(client))
+        viewers[client_id] = client
     
     # If a viewer connects after its camera, immediately replay the last stored offer
     # from that camera so the WebRTC handshake can start without restarting the sender.
@@ -64,7 +150,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                         "to": client_id,
                         "sdp": camera_client.last_offer,
                     }
-                    await websocket.send_text(json.dumps(offer_msg))
+                    await websocket.send_text(json_dumps(offer_msg))
                     logger.info(
                         f"📤 Replayed stored offer from '{camera_peer_id}' to late viewer '{client_id}' on connect"
                     )
@@ -79,7 +165,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
         while True:
             try:
                 data = await websocket.receive_text()
-                msg = json.loads(data)
+                msg = json_loads(data)
             except Exception as e:
                 logger.error(f"❌ Receive error from {client_id}: {e}")
                 break
@@ -95,21 +181,16 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                     logger.info(f"📨 Camera '{client_id}' sent offer")
                     
                     # Forward to specific viewer or all viewers
-                    if target and target in clients:
+                    peer = clients.get(target) if target else None
+                    if peer is not None:
                         try:
-                            await clients[target].websocket.send_text(data)
+                            await send_to_peer(peer, data)
                             logger.info(f"📤 Forwarded offer to viewer '{target}'")
                         except Exception as e:
                             logger.error(f"❌ Failed to forward offer to {target}: {e}")
                     else:
-                        # Broadcast to all connected viewers
-                        for viewer_id, viewer in clients.items():
-                            if not viewer.is_camera:
-                                try:
-                                    await viewer.websocket.send_text(data)
-                                    logger.info(f"📤 Broadcast offer to viewer '{viewer_id}'")
-                                except Exception as e:
-                                    logger.error(f"❌ Failed to broadcast to {viewer_id}: {e}")
+                        # Queue for all connected viewers; each viewer's sender task delivers it
+                        broadcast_to_viewers(data)
             
             # ===== ANSWER: Viewer sends answer back to camera =====
             elif msg_type == "answer":
@@ -119,30 +200,24 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                     logger.info(f"📨 Viewer '{client_id}' sent answer")
                     
                     # Forward to camera
-                    if target and target in clients:
+                    peer = clients.get(target) if target else None
+                    if peer is not None:
                         try:
-                            await clients[target].websocket.send_text(data)
+                            await send_to_peer(peer, data)
                             logger.info(f"📤 Forwarded answer to camera '{target}'")
                         except Exception as e:
                             logger.error(f"❌ Failed to forward answer: {e}")
             
-            # ===== ICE: Forward ICE candidates =====
-            elif msg_type == "ice":
-                if target and target in clients:
-                    try:
-                        await clients[target].websocket.send_text(data)
-                        logger.debug(f"🔄 Forwarded ICE candidate to '{target}'")
-                    except Exception as e:
-                        logger.error(f"❌ Failed to forward ICE: {e}")
-            
-            # ===== ICE-COMPLETE: Signal ICE gathering done =====
-            elif msg_type == "ice-complete":
-                if target and target in clients:
+            # ===== ICE: Forward ICE candidates and end-of-gathering =====
+            # "ice-batch" carries several candidates in one message; all are forwarded as-is
+            elif msg_type in ICE_MESSAGE_TYPES:
+                peer = clients.get(target) if target else None
+                if peer is not None:
                     try:
-                        await clients[target].websocket.send_text(data)
-                        logger.info(f"✅ Forwarded ICE-complete to '{target}'")
+                        await send_to_peer(peer, data)
+                        logger.debug("🔄 Forwarded %s to '%s'", msg_type, target)
                     except Exception as e:
-                        logger.error(f"❌ Failed to forward ICE-complete: {e}")
+                        logger.error(f"❌ Failed to forward {msg_type}: {e}")
             
             # ===== HELLO: Viewer explicitly requests latest offer from its camera =====
             elif msg_type == "hello":
@@ -159,7 +234,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                                     "to": client_id,
                                     "sdp": camera_client.last_offer,
                                 }
-                                await websocket.send_text(json.dumps(offer_msg))
+                                await websocket.send_text(json_dumps(offer_msg))
                                 logger.info(
                                     f"📤 Replayed stored offer from '{camera_peer_id}' to viewer '{client_id}' on hello"
                                 )
@@ -173,13 +248,12 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
             # ===== PING: Keep-alive heartbeat =====
             elif msg_type == "ping":
                 try:
-                    pong_msg = {"type": "pong", "from": "signaling"}
-                    await websocket.send_text(json.dumps(pong_msg))
+                    await websocket.send_text(PONG_MSG)
                 except Exception as e:
                     logger.error(f"❌ Ping/pong error: {e}")
             
             else:
-                logger.debug(f"Unknown message type: {msg_type}")
+                logger.debug("Unknown message type: %s", msg_type)
     
     except WebSocketDisconnect:
         logger.info(f"🔌 {role} '{client_id}' disconnected")
@@ -187,21 +261,38 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
         logger.error(f"❌ Error in {client_id}: {e}")
     
     finally:
-        if client_id in clients:
+        # Only remove entries that still belong to this connection; a client that
+        # reconnected with the same id has already replaced them
+        if clients.get(client_id) is client:
             del clients[client_id]
+        if viewers.get(client_id) is client:
+            del viewers[client_id]
+        if client.sender_task:
+            client.sender_task.cancel()
         logger.info(f"📊 Active clients: {len(clients)}")
 
 @app.get("/")
 async def root():
-    return {"message":"Signaling server running"}
+    return Response(ROOT_BODY, media_type="application/json")
 
 @app.get("/viewer", response_class=HTMLResponse)
 async def serve_viewer():
-    if not VIEWER_FILE.exists():
+    if VIEWER_HTML is None:
         return HTMLResponse("viewer.html not found", status_code=404)
-    return VIEWER_FILE.read_text(encoding="utf-8")
+    return HTMLResponse(VIEWER_HTML)
 
 if __name__ == "__main__":
-    uvicorn.run("server_signaling:app", host="0.0.0.0", port=8000, log_level="info")
+    # uvicorn's "auto" loop/http/ws settings already pick uvloop, httptools and
+    # websockets when installed; log what that resolves to here
+    loop_impl = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http_impl = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    ws_impl = "websockets" if importlib.util.find_spec("websockets") else "wsproto"
+    logger.info(f"⚙️ Event loop: {loop_impl}, HTTP parser: {http_impl}, WebSocket: {ws_impl}")
+    # Signaling frames are a few KB of SDP at most, so cap inbound frames at 1 MiB.
+    # permessage-deflate is off: the relay would inflate and re-deflate every
+    # forwarded message, which costs more CPU than it saves on frames this small.
+    uvicorn.run("server_signaling:app", host="0.0.0.0", port=8000, log_level="info",
+                ws_max_size=1_048_576,
+                ws_per_message_deflate=False)
 
 # ============================================================================================
\ No newline at end of file